@@ -4,8 +4,9 @@ import secret_token
 
 import fight_db
 
+import asyncio
 import base64
-from io import BytesIO
+from io import BytesIO, StringIO
 import requests
 import json
 import random
@@ -139,11 +140,11 @@ async def full(interaction: discord.Interaction, ship: discord.Attachment, boost
         # try API_NEW and if it fails, try API_URL
         try:
             url = API_NEW + "analyze"
-            response = requests.post(url, json=json_data)
+            response = await asyncio.to_thread(requests.post, url, json=json_data)
             response.raise_for_status()
         except requests.exceptions.HTTPError:
             url = API_URL + "analyze"
-            response = requests.post(url, json=json_data)
+            response = await asyncio.to_thread(requests.post, url, json=json_data)
             response.raise_for_status()
         print(dt.now(),"server responded")
         # Get the response
@@ -245,11 +246,11 @@ async def compare(interaction: discord.Interaction, ship1: int, ship2: int, scal
     # try API_NEW and if it fails, try API_URL
     try:
         url = API_NEW + 'compare?ship1=' + str(ship1) + '&ship2=' + str(ship2) + '&scale=' + str(scale)
-        response = requests.get(url)
+        response = await asyncio.to_thread(requests.get, url)
         response.raise_for_status()
     except requests.exceptions.HTTPError:
         url = API_URL + 'compare?ship1=' + str(ship1) + '&ship2=' + str(ship2) + '&scale=' + str(scale)
-        response = requests.get(url)
+        response = await asyncio.to_thread(requests.get, url)
         response.raise_for_status()
     print(dt.now(),"server responded")
     # Get the response
@@ -444,19 +445,13 @@ async def db_add_fight(interaction: discord.Interaction, shipname1: str, shipnam
 
     try:
         if not switched_ship_names:
-            for ship_name in shipname2.split(","):
-                if not_a_draw and ship_name == shipname1:
-                    await interaction.response.send_message(f"Can not add a non draw result for 2 ships of the same type.")
-                    return
-                else:
-                    db.insert_fight(shipname1, ship_name, author, author_name, result)
+            fights = [(shipname1, ship_name) for ship_name in shipname2.split(",")]
         else:
-            for ship_name in shipname1.split(","):
-                if not_a_draw and ship_name == shipname2:
-                    await interaction.response.send_message(f"Can not add a non draw result for 2 ships of the same type.")
-                    return
-                else:
-                    db.insert_fight(ship_name, shipname2, author, author_name, result)
+            fights = [(ship_name, shipname2) for ship_name in shipname1.split(",")]
+        if not_a_draw and any(ship1 == ship2 for ship1, ship2 in fights):
+            await interaction.response.send_message(f"Can not add a non draw result for 2 ships of the same type.")
+            return
+        db.insert_fights(fights, author, author_name, result)
 
         winner_text=""
         if result==fight_db.FIGHT_RESULT.WIN:
@@ -518,17 +513,11 @@ async def db_simulate_fight(interaction: discord.Interaction, shipname1: str, sh
     shipname1=shipname1.lower().strip()
     shipname2=shipname2.lower().strip()
     try:
-        result=db.simulate_fight(shipname1, shipname2)
-        people_win=result.get(fight_db.FIGHT_RESULT.WIN)
-        if people_win==None:
-            people_win=[]
-        people_draw=result.get(fight_db.FIGHT_RESULT.DRAW)
-        if people_draw==None:
-            people_draw=[]
-        people_lose=result.get(fight_db.FIGHT_RESULT.LOSE)
-        if people_lose==None:
-            people_lose=[]
-        text=f"In a fight between {shipname1} and {shipname2}, the results are:\n {len(people_win)} people think {shipname1} would win\n {len(people_draw)} people think it would be a draw\n {len(people_lose)} people think {shipname2} would win"
+        result=db.count_fight_results(shipname1, shipname2)
+        people_win=result[fight_db.FIGHT_RESULT.WIN]
+        people_draw=result[fight_db.FIGHT_RESULT.DRAW]
+        people_lose=result[fight_db.FIGHT_RESULT.LOSE]
+        text=f"In a fight between {shipname1} and {shipname2}, the results are:\n {people_win} people think {shipname1} would win\n {people_draw} people think it would be a draw\n {people_lose} people think {shipname2} would win"
         await interaction.response.send_message(text)
     except Exception as e:
         await interaction.response.send_message(f"Error:{e}")
@@ -537,9 +526,8 @@ async def db_simulate_fight(interaction: discord.Interaction, shipname1: str, sh
 @tree.command(name="db_list_ships", description='lists all ships in the database')
 async def db_list_ships(interaction: discord.Interaction):
     try:
-        ships=db.get_ships()
         #sort the ships
-        ships.sort()
+        ships=sorted(db.get_ships())
         text="Ships in the database:\n"
         for ship in ships:
             text+=f"- {ship}\n"
@@ -564,9 +552,11 @@ async def db_get_unknown_matchups(interaction: discord.Interaction, shipname: st
 @tree.command(name="db_export_csv", description='exports the database to a csv file')
 async def db_export_csv(interaction: discord.Interaction):
     try:
-        db.export_csv("fight_database.csv")
+        # Export in memory, so concurrent exports don't overwrite each other's file
+        csv_text = StringIO()
+        db.write_csv(csv_text)
         # Create a file object for the CSV file
-        csv_file = discord.File("fight_database.csv", filename="fight_database.csv")
+        csv_file = discord.File(BytesIO(csv_text.getvalue().encode("utf-8")), filename="fight_database.csv")
         # Send the CSV file to the user
         await interaction.response.send_message("Database exported to CSV file", file=csv_file)
     except Exception as e:
@@ -577,6 +567,8 @@ async def db_export_csv(interaction: discord.Interaction):
 async def db_export_db(interaction: discord.Interaction):
     try:
         #db.export_db("fight_database.db")
+        # Write the pending WAL changes to test.db before sending it
+        db.checkpoint()
         # Create a file object for the DB file
         db_file = discord.File(BOT_PATH+"test.db", filename="fight_database.db")
         # Send the DB file to the user
@@ -602,11 +594,8 @@ async def db_rename_ship(interaction: discord.Interaction, old_name: str, new_na
 @tree.command(name="db_scoreboard", description='shows the scoreboard of the database')
 async def db_scoreboard(interaction: discord.Interaction, player_name: str=None):
     try:
-        ships=db.get_ships()
-        scoreboard={}
-        for s in ships:
-            wins, draws, losses=db.get_matchups(s, player_name)
-            scoreboard[s]=[len(wins), len(draws), len(losses), len(wins)+len(draws)+len(losses)]
+        scoreboard=db.get_scoreboard(player_name)
+        ships=list(scoreboard)
         #sort the ships by number of wins
         ships.sort(key=lambda x: scoreboard[x][0], reverse=True)
         table = "Scoreboard             |Win|Draw|Lost|Total\n"
@@ -619,3 +608,4 @@ async def db_scoreboard(interaction: discord.Interaction, player_name: str=None)
 
 # #client.run(os.getenv("DISCORDBOTAPI"))
 client.run(secret_token.token)
+db.close()
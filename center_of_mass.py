@@ -971,6 +971,25 @@ def com(input_filename, output_filename,args):
     # to do : push speed directions to discord, need update to bot.py
     return data_com, data_cot, speeds, direction_mapping[decoded_data["FlightDirection"]], error_message, base64_output
 
+def com_bytes(input_bytes, args):
+    """
+    Calculate the center of mass, center of thrust, and speed of a ship, without touching the disk.
+
+    Args:
+        input_bytes (bytes): The content of the ship.png.
+        args (dict): Additional arguments, same as com.
+
+    Returns:
+        tuple: A tuple containing the center of mass, center of thrust, speeds, ship direction, error message,
+        and the png bytes of the output image (None if the ship could not be drawn).
+
+    """
+    data_com, data_cot, speeds, ship_direction, error_message, base64_output = com(base64.b64encode(input_bytes).decode("utf-8"), "", args)
+    if base64_output.startswith("error"):
+        # draw_ship returns an error message instead of the image
+        return data_com, data_cot, speeds, ship_direction, error_message + base64_output, None
+    return data_com, data_cot, speeds, ship_direction, error_message, base64.b64decode(base64_output)
+
 if(__name__ == "__main__"):
     com(SHIP, "out.png", {"boost":BOOST,"draw_all_cot":DRAW_ALL_COT,"draw_all_com":DRAW_ALL_COM,"draw_cot":DRAW_COT,"draw_com":DRAW_COM,"flip_vectors":FLIP_VECTORS})
 
@@ -1,14 +1,61 @@
+import copy
+import csv
+import functools
 import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
 
 class FIGHT_RESULT:
     DRAW = 0
     WIN = 1
     LOSE = -1 #do not store lose in the database, instead, switch the shipname1 and shipname2
 
+def locked(method):
+    # Hold the connection lock while the method runs, the same FightDB can be used from several threads
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+READ_CACHE_SIZE = 256
+
+def cached_read(method):
+    # Memoize a read method in self.read_cache, an LRU of READ_CACHE_SIZE results of the current database version
+    # every call returns a copy, so callers can modify the result without changing what later calls get
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        with self.lock:
+            if self.read_cache_version != self.version:
+                self.read_cache.clear()
+                self.read_cache_version = self.version
+            if key in self.read_cache:
+                self.read_cache.move_to_end(key)
+            else:
+                self.read_cache[key] = method(self, *args, **kwargs)
+                if len(self.read_cache) > READ_CACHE_SIZE:
+                    self.read_cache.popitem(last=False)
+            return copy.deepcopy(self.read_cache[key])
+    return wrapper
+
 class FightDB:
     def __init__(self, db_name="test.db"):
-        self.con = sqlite3.connect(db_name)
+        self.con = sqlite3.connect(db_name, check_same_thread=False)
+        self.db_uri = Path(db_name).resolve().as_uri() # used to open the read-only connections of get_fights
+        self.lock = threading.RLock() # the connection and cursor are shared, see locked
         self.cur = self.con.cursor()
+        # WAL with synchronous=NORMAL only syncs on checkpoints, and a 64 MB page cache keeps the whole db in memory
+        self.cur.executescript("""PRAGMA journal_mode=WAL;
+                                  PRAGMA synchronous=NORMAL;
+                                  PRAGMA cache_size=-65536;
+                                  PRAGMA temp_store=MEMORY;
+                                  PRAGMA mmap_size=268435456;""")
+        self.shipnames = None # in-memory cache of every ship name, see get_shipnames
+        self.version = 0 # incremented by every write, see cached_read
+        self.read_cache = OrderedDict() # results of the cached read methods, see cached_read
+        self.read_cache_version = self.version
         self.cur.execute("""CREATE TABLE IF NOT EXISTS Fights (
                                 id INTEGER PRIMARY KEY,
                                 shipname1 TEXT NOT NULL,
@@ -17,54 +64,111 @@ class FightDB:
                                 author_name TEXT NOT NULL,
                                 result INTEGER NOT NULL
                             );""")
+        self.cur.execute("CREATE INDEX IF NOT EXISTS idx_fights_pair ON Fights (shipname1, shipname2, result)")
+        self.cur.execute("CREATE INDEX IF NOT EXISTS idx_fights_s2_s1 ON Fights (shipname2, shipname1)")
         self.con.commit()
 
+    @locked
     def insert_fight(self, shipname1, shipname2, author, author_name, result):
-        # Check if shipname1 and shipname2 exist in the database
-        if not self.ship_exists(shipname1):
-            raise ValueError(f"Ship '{shipname1}' does not exist in the database")
-        if not self.ship_exists(shipname2):
-            raise ValueError(f"Ship '{shipname2}' does not exist in the database")
+        self.insert_fights([(shipname1, shipname2)], author, author_name, result)
 
-        self.cur.execute("SELECT id FROM Fights WHERE (shipname1 = ? AND shipname2 = ? AND author = ?) OR (shipname1 = ? AND shipname2 = ? AND author = ?)",
-                         (shipname1, shipname2, author, shipname2, shipname1, author))
-        existing_fight = self.cur.fetchone()
+    @locked
+    def insert_fights(self, fights, author, author_name, result):
+        # Insert every (shipname1, shipname2) pair in fights with the same author and result
+        # Check if every ship exists in the database
+        self.check_ships_exist(*(shipname for fight in fights for shipname in fight))
 
-        if existing_fight:# Remove the existing fight
-            print("Removing existing fight")
-            self.cur.execute("DELETE FROM Fights WHERE id = ?", (existing_fight[0],))
+        # One vote per author per matchup, a repeated matchup replaces the earlier one like separate inserts would
+        unique_fights = {}
+        for shipname1, shipname2 in fights:
+            matchup = frozenset((shipname1, shipname2))
+            unique_fights.pop(matchup, None)
+            unique_fights[matchup] = (shipname1, shipname2)
+        fights = list(unique_fights.values())
 
-        # Insert the new fight
-        self.cur.execute("INSERT INTO Fights (shipname1, shipname2, author, author_name, result) VALUES (?, ?, ?, ?, ?)", (shipname1, shipname2, author, author_name, result))
-        self.con.commit()
+        # Replace the fights in a single transaction, committed once or rolled back on error
+        with self.con:
+            # Remove the existing fights of this author, in either order
+            self.cur.executemany("DELETE FROM Fights WHERE (shipname1 = ?1 AND shipname2 = ?2 AND author = ?3) OR (shipname1 = ?2 AND shipname2 = ?1 AND author = ?3)",
+                                 [(shipname1, shipname2, author) for shipname1, shipname2 in fights])
+            if self.cur.rowcount > 0:
+                print(f"Removing {self.cur.rowcount} existing fights")
 
+            # Insert the new fights
+            self.cur.executemany("INSERT INTO Fights (shipname1, shipname2, author, author_name, result) VALUES (?, ?, ?, ?, ?)",
+                                 [(shipname1, shipname2, author, author_name, result) for shipname1, shipname2 in fights])
+        self.version += 1
+
+    @locked
+    def get_shipnames(self):
+        # Load every ship name once, the methods that can add or remove ships keep the cache up to date
+        if self.shipnames is None:
+            self.cur.execute("SELECT shipname1 FROM Fights UNION SELECT shipname2 FROM Fights")
+            self.shipnames = {row[0] for row in self.cur.fetchall()}
+        return self.shipnames
+
+    @locked
     def ship_exists(self, shipname):
-        self.cur.execute("SELECT 1 FROM Fights WHERE shipname1 = ? OR shipname2 = ?", (shipname, shipname))
-        return bool(self.cur.fetchone())
+        return shipname in self.get_shipnames()
+
+    @locked
+    def ship_in_fights(self, shipname):
+        # Ask the database directly, stopping at the first fight of the ship
+        self.cur.execute("SELECT 1 FROM Fights WHERE shipname1 = ?1 OR shipname2 = ?1 LIMIT 1", (shipname,))
+        return self.cur.fetchone() is not None
+
+    @locked
+    def missing_ships(self, shipnames):
+        # Return the set of shipnames that do not exist in the database
+        return set(shipnames) - self.get_shipnames()
+
+    @locked
+    def check_ships_exist(self, *shipnames):
+        # Raise a ValueError for the first of shipnames that does not exist in the database
+        missing_ships = self.missing_ships(shipnames)
+        for shipname in shipnames:
+            if shipname in missing_ships:
+                raise ValueError(f"Ship '{shipname}' does not exist in the database")
 
+    @locked
     def remove_fight(self, shipname1, shipname2, author):
         # Remove the fight between shipname1 and shipname2 with the specified author
         self.cur.execute("DELETE FROM Fights WHERE (shipname1 = ? AND shipname2 = ? AND author = ?) OR (shipname1 = ? AND shipname2 = ? AND author = ?)",
                          (shipname1, shipname2, author, shipname2, shipname1, author))
         self.con.commit()
+        self.version += 1
+        # the removed fight may have been the last one of a ship
+        if self.shipnames is not None:
+            for shipname in (shipname1, shipname2):
+                if not self.ship_in_fights(shipname):
+                    self.shipnames.discard(shipname)
 
+    @locked
     def add_ship(self, shipname, author, author_name):
         # Add a fight where the ship fights against itself
         if not self.ship_exists(shipname):
             self.cur.execute("INSERT INTO Fights (shipname1, shipname2, author, author_name, result) VALUES (?, ?, ?, ?, ?)", (shipname, shipname, author, author_name, FIGHT_RESULT.DRAW))
             self.con.commit()
+            self.version += 1
+            self.shipnames.add(shipname)
 
     def get_fights(self):
-        self.cur.execute("SELECT * FROM Fights")
-        return self.cur.fetchall()
+        # Yield the fights one by one, from a separate read-only connection
+        # in WAL mode it reads a snapshot of the db, so writes from other threads neither wait for it nor show up halfway
+        con = sqlite3.connect(self.db_uri + "?mode=ro", uri=True, check_same_thread=False)
+        try:
+            yield from con.execute("SELECT * FROM Fights")
+        finally:
+            con.close()
 
+    @cached_read
+    @locked
     def get_matchups(self, ship_name, player_name=None):
         wins={}
         draws={}
         losses={}
         # Get all fights where the specified ship is involved
-        if not self.ship_exists(ship_name):
-            raise ValueError(f"Ship '{ship_name}' does not exist in the database")
+        self.check_ships_exist(ship_name)
         self.cur.execute("SELECT shipname1, shipname2, author_name, result FROM Fights WHERE (shipname1 = ? OR shipname2 = ?)", (ship_name, ship_name))
         fight_data = self.cur.fetchall()
         # Iterate over each fight data
@@ -90,70 +194,100 @@ class FightDB:
                             losses[ship1] = [author_name]
 
         return wins, draws, losses
+
+    @cached_read
+    @locked
+    def get_scoreboard(self, player_name=None):
+        # Count the ships each ship has won, drawn and lost against, for every ship in a single query
+        scoreboard = {ship: [0, 0, 0, 0] for ship in self.get_ships()}
+        # every fight is seen once from each side, a win for shipname1 is a loss for shipname2
+        self.cur.execute("""SELECT ship,
+                                   COUNT(DISTINCT CASE WHEN result = ?1 THEN opponent END),
+                                   COUNT(DISTINCT CASE WHEN result = ?2 THEN opponent END),
+                                   COUNT(DISTINCT CASE WHEN result = ?3 THEN opponent END)
+                            FROM (SELECT shipname1 AS ship, shipname2 AS opponent, result, author_name FROM Fights
+                                  UNION ALL
+                                  SELECT shipname2, shipname1, CASE WHEN result = ?1 THEN ?3 ELSE result END, author_name FROM Fights)
+                            WHERE ?4 IS NULL OR author_name = ?4
+                            GROUP BY ship""",
+                         (FIGHT_RESULT.WIN, FIGHT_RESULT.DRAW, FIGHT_RESULT.LOSE, player_name))
+        for ship, wins, draws, losses in self.cur.fetchall():
+            if ship in scoreboard:
+                scoreboard[ship] = [wins, draws, losses, wins + draws + losses]
+        return scoreboard
+
+    @cached_read
+    @locked
     def get_unknown_matchups(self, shipname, player_name=None):
-        """
         # Get all ships that the specified ship has not fought against
         # check if the ship exists
-        if not self.ship_exists(shipname):
-            raise ValueError(f"Ship '{shipname}' does not exist in the database")
-        ships=self.get_ships()
-        for ship in ships:
-            self.cur.execute("SELECT * FROM Fights WHERE (shipname1 = ? AND shipname2 = ?) OR (shipname1 = ? AND shipname2 = ?)", (shipname, ship, ship, shipname))
-            if self.cur.fetchone():
-                ships.remove(ship)
-        return ships
-        """
-        ships=self.get_ships()
-        wins, draws, losses = self.get_matchups(shipname, player_name)
-        matchups= wins.keys() | draws.keys() | losses.keys()
-        unknown_matchups = [ship for ship in ships if ship not in matchups]
-        return unknown_matchups
+        self.check_ships_exist(shipname)
+        # run the anti-join once per ship, not once per fight
+        self.cur.execute("""SELECT s.ship FROM (SELECT DISTINCT shipname1 AS ship FROM Fights) s WHERE NOT EXISTS (
+                                SELECT 1 FROM Fights f
+                                WHERE ((f.shipname1 = ?1 AND f.shipname2 = s.ship) OR (f.shipname2 = ?1 AND f.shipname1 = s.ship))
+                                AND (?2 IS NULL OR f.author_name = ?2))""",
+                         (shipname, player_name))
+        return [row[0] for row in self.cur.fetchall()]
 
 
 
+    @locked
     def export_csv(self, filename):
         # Export the database to a CSV file
-        self.cur.execute("SELECT shipname1, shipname2, result, author_name FROM Fights")
         with open(filename, "w",encoding="utf-8") as f:
-            f.write("shipname1,shipname2,result,author_name\n")
-            for row in self.cur.fetchall():
-                f.write(",".join(map(str, row)) + "\n")
+            self.write_csv(f)
 
+    @locked
+    def write_csv(self, f):
+        # Write the database as CSV to an open text file
+        self.cur.execute("SELECT shipname1, shipname2, result, author_name FROM Fights")
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(("shipname1", "shipname2", "result", "author_name"))
+        writer.writerows(self.cur)
+
+    @locked
     def export_db(self, filename):
         # copy the database to a new file
-        with open(filename, "wb") as f:
-            for line in self.con.iterdump():
-                f.write(bytes(line, "utf-8"))
+        with open(filename, "w", encoding="utf-8", buffering=1 << 20) as f:
+            f.writelines(line + "\n" for line in self.con.iterdump())
 
 
+    @locked
     def simulate_fight(self, shipname1, shipname2):
         # check if the ships exist
-        if not self.ship_exists(shipname1):
-            raise ValueError(f"Ship '{shipname1}' does not exist in the database")
-        if not self.ship_exists(shipname2):
-            raise ValueError(f"Ship '{shipname2}' does not exist in the database")
+        self.check_ships_exist(shipname1, shipname2)
         # Check if the fight is in the database
-        result_authors = {}
-        #search the winners
-        self.cur.execute("SELECT author_name FROM Fights WHERE (shipname1 = ? AND shipname2 = ? AND result = ?)", (shipname1, shipname2, FIGHT_RESULT.WIN))
-        winners = self.cur.fetchall()
-        #search the losers
-        self.cur.execute("SELECT author_name FROM Fights WHERE (shipname1 = ? AND shipname2 = ? AND result = ?)", (shipname2, shipname1, FIGHT_RESULT.WIN))
-        losers = self.cur.fetchall()
-        #search the draws
-        self.cur.execute("SELECT author_name FROM Fights WHERE ((shipname1 = ? AND shipname2 = ? AND result = ?) OR (shipname1 = ? AND shipname2 = ? AND result = ?))", (shipname1, shipname2, FIGHT_RESULT.DRAW, shipname2, shipname1, FIGHT_RESULT.DRAW))
-        draws = self.cur.fetchall()
-
-        result_authors[FIGHT_RESULT.WIN] = winners
-        result_authors[FIGHT_RESULT.DRAW] = draws
-        result_authors[FIGHT_RESULT.LOSE] = losers
+        result_authors = {FIGHT_RESULT.WIN: [], FIGHT_RESULT.DRAW: [], FIGHT_RESULT.LOSE: []}
+        # search the winners, losers and draws in a single query, shipname1 is the ship that won
+        self.cur.execute("""SELECT CASE WHEN result = ?3 THEN ?3 WHEN shipname1 = ?1 THEN ?4 ELSE ?5 END, author_name FROM Fights
+                            WHERE ((shipname1 = ?1 AND shipname2 = ?2) OR (shipname1 = ?2 AND shipname2 = ?1)) AND (result = ?3 OR result = ?4)""",
+                         (shipname1, shipname2, FIGHT_RESULT.DRAW, FIGHT_RESULT.WIN, FIGHT_RESULT.LOSE))
+        for result, author_name in self.cur.fetchall():
+            result_authors[result].append((author_name,))
 
         return result_authors
 
+    @locked
+    def count_fight_results(self, shipname1, shipname2):
+        # Same as simulate_fight, but only count the authors of each result
+        self.check_ships_exist(shipname1, shipname2)
+        result_counts = {FIGHT_RESULT.WIN: 0, FIGHT_RESULT.DRAW: 0, FIGHT_RESULT.LOSE: 0}
+        self.cur.execute("""SELECT CASE WHEN result = ?3 THEN ?3 WHEN shipname1 = ?1 THEN ?4 ELSE ?5 END, COUNT(*) FROM Fights
+                            WHERE ((shipname1 = ?1 AND shipname2 = ?2) OR (shipname1 = ?2 AND shipname2 = ?1)) AND (result = ?3 OR result = ?4)
+                            GROUP BY 1""",
+                         (shipname1, shipname2, FIGHT_RESULT.DRAW, FIGHT_RESULT.WIN, FIGHT_RESULT.LOSE))
+        for result, count in self.cur.fetchall():
+            result_counts[result] = count
+        return result_counts
+
+    @cached_read
+    @locked
     def get_ships(self):
         self.cur.execute("SELECT DISTINCT shipname1 FROM Fights")
         return [row[0] for row in self.cur.fetchall()]
 
+    @locked
     def rename_ship(self, old_name, new_name):
         #check if the ship exists
         if not self.ship_exists(old_name):
@@ -162,14 +296,26 @@ class FightDB:
         if self.ship_exists(new_name):
             raise ValueError(f"Ship '{new_name}' already exists in the database")
         # Rename the ship in the database
-        self.cur.execute("UPDATE Fights SET shipname1 = ? WHERE shipname1 = ?", (new_name, old_name))
-        self.cur.execute("UPDATE Fights SET shipname2 = ? WHERE shipname2 = ?", (new_name, old_name))
+        self.cur.execute("""UPDATE Fights SET shipname1 = CASE WHEN shipname1 = ?1 THEN ?2 ELSE shipname1 END,
+                                              shipname2 = CASE WHEN shipname2 = ?1 THEN ?2 ELSE shipname2 END
+                            WHERE shipname1 = ?1 OR shipname2 = ?1""", (old_name, new_name))
         self.con.commit()
+        self.version += 1
+        self.shipnames.discard(old_name)
+        self.shipnames.add(new_name)
+
+    @locked
+    def checkpoint(self):
+        # Move the WAL contents into the main db file, call it before copying the file
+        self.cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
+    @locked
     def close(self):
+        # Let sqlite refresh the statistics the query planner uses to pick the indexes
+        self.cur.execute("PRAGMA optimize")
         self.con.close()
 
 if(__name__=="__main__"):
     db = FightDB()
-    print(db.get_fights())
+    print(list(db.get_fights()))
     db.close()
\ No newline at end of file
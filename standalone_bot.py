@@ -4,10 +4,15 @@ from discord import app_commands
 import secret_token
 import center_of_mass
 import asyncio
+import time
+import traceback
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
 
 intents = discord.Intents.default()
 client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
+process_pool = ProcessPoolExecutor(max_workers=2) # runs center_of_mass.com without blocking the event loop
 
 short_version_text="Made by LunastroD, Aug 2023 - Sep 2023"
 version_text=short_version_text+", for the Excelsior discord server and the Cosmoteer community :3\n    -Check out the source code at <https://github.com/lunastrod/cosmoteer-com>"
@@ -32,11 +37,17 @@ help_text="""/version: """+version_text+"""
 
 - If you notice any mistakes on things like the total mass or the speed, ping LunastroD"""
 
+def read_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
 @client.event
 async def on_ready():
     await client.change_presence(activity=discord.Game(name="Cosmoteer (/help)"))
     print("Syncing slash commands")
     await tree.sync()
+    # Draw the legend once, instead of rewriting the same file on every /help
+    center_of_mass.draw_legend("legend.png")
     print("Guilds:")
     for guild in client.guilds:
         print("\t- " + guild.name, guild.id)
@@ -46,35 +57,35 @@ async def on_ready():
 async def com(interaction: discord.Interaction, ship: discord.Attachment, boost: bool = True, flipvectors: bool = False, strafecot: bool = True, partcom: bool = False):
     print("defer")
     await interaction.response.defer()
-    print("deferred, saving")
-    await ship.save('discord_bot/ship.ship.png')
-    #copy legend.png to out.png
-    with open('legend.png', 'rb') as f, open("discord_bot/out.png", "wb") as s:
-        s.write(f.read())
-    print("saved, calculating")
+    print("deferred, reading")
+    ship_bytes = await ship.read()
+    print("read, calculating")
+    start = time.perf_counter()
     try:
         args={"boost":boost,"draw_all_cot":strafecot,"draw_all_com":partcom,"draw_cot":True,"draw_com":True,"flip_vectors":flipvectors}
-        data_com, data_cot, speed, error_msg=center_of_mass.com("discord_bot/ship.ship.png", "discord_bot/out.png",args)#calculate the center of mass
-    except:
-        await interaction.followup.send("Error: could not process ship",file=discord.File("discord_bot/ship.ship.png"))
+        data_com, data_cot, speeds, direction, error_msg, picture_bytes=await asyncio.get_running_loop().run_in_executor(process_pool, center_of_mass.com_bytes, ship_bytes, args)#calculate the center of mass
+    except Exception as e:
+        print(f"could not process ship after {(time.perf_counter() - start) * 1000:.0f}ms")
+        traceback.print_exc()
+        await interaction.followup.send("Error: could not process ship :\n\t" + type(e).__name__ + ":" + str(e),file=discord.File(BytesIO(ship_bytes), filename="ship.ship.png"))
         return
-    print("calculated, sending")
-    with open('discord_bot/out.png', 'rb') as f, open("discord_bot/ship.ship.png", "rb") as s:#send the output image
-        picture = discord.File(f)
-        ship = discord.File(s)
-        files_to_send: list[discord.File] = [ship,picture]
-        text=""
-        text+=error_msg
-        text+="use the /help command for more info\n"
-        text+="Center of mass: " + str(round(data_com[0],2)) + ", " + str(round(data_com[1],2)) + "\n"
-        text+="Total mass: " + str(round(data_com[2],2)) + "t\n"
-        text+="Predicted max speed: " + str(round(speed,2)) + "m/s\n"
+    print(f"calculated in {(time.perf_counter() - start) * 1000:.0f}ms, sending")
+    if picture_bytes is None:
+        #the ship could not be drawn, send the legend instead
+        picture_bytes = await asyncio.to_thread(read_file, 'legend.png')
+    picture = discord.File(BytesIO(picture_bytes), filename="out.png")
+    ship = discord.File(BytesIO(ship_bytes), filename="ship.ship.png")
+    files_to_send: list[discord.File] = [ship,picture]
+    text=""
+    text+=error_msg
+    text+="use the /help command for more info\n"
+    text+="Center of mass: " + str(round(data_com[0],2)) + ", " + str(round(data_com[1],2)) + "\n"
+    text+="Total mass: " + str(round(data_com[2],2)) + "t\n"
+    text+="Predicted max speed: " + str(round(speeds[direction],2)) + "m/s\n"
 
-        
-        await asyncio.sleep(3)
-        await interaction.followup.send(text,files=files_to_send)
-        print(text)
-        print("sent")
+    await interaction.followup.send(text,files=files_to_send)
+    print(text)
+    print("sent")
         
 
 
@@ -85,7 +96,8 @@ async def version(interaction: discord.Interaction):
 @tree.command(name="help", description="shows the list of commands")
 async def help(interaction: discord.Interaction):
     await interaction.response.defer()
-    center_of_mass.draw_legend("legend.png")
     await interaction.followup.send(help_text,file=discord.File("legend.png"))
 
-client.run(secret_token.token)
+if(__name__=="__main__"):
+    client.run(secret_token.token)
+    process_pool.shutdown()
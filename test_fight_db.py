@@ -0,0 +1,107 @@
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+import fight_db
+
+
+class FightDBTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = fight_db.FightDB(os.path.join(self.tmp_dir.name, "test.db"))
+        for shipname in ("a", "b", "c"):
+            self.db.add_ship(shipname, "1", "player")
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp_dir.cleanup()
+
+    def fights_between(self, shipname1, shipname2):
+        return [fight for fight in self.db.get_fights() if {fight[1], fight[2]} == {shipname1, shipname2}]
+
+    def test_repeated_opponent_is_a_single_vote(self):
+        self.db.insert_fights([("a", "b"), ("a", "b"), ("a", "c")], "1", "player", fight_db.FIGHT_RESULT.WIN)
+        self.assertEqual(len(self.fights_between("a", "b")), 1)
+        self.assertEqual(len(self.fights_between("a", "c")), 1)
+        self.assertEqual(self.db.count_fight_results("a", "b")[fight_db.FIGHT_RESULT.WIN], 1)
+
+    def test_repeated_matchup_keeps_the_last_result(self):
+        self.db.insert_fight("a", "b", "1", "player", fight_db.FIGHT_RESULT.WIN)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.db.insert_fights([("a", "b"), ("b", "a")], "1", "player", fight_db.FIGHT_RESULT.WIN)
+        fights = self.fights_between("a", "b")
+        self.assertEqual(len(fights), 1)
+        self.assertEqual((fights[0][1], fights[0][2]), ("b", "a"))
+
+    def test_concurrent_write_does_not_tear_get_fights(self):
+        self.db.insert_fight("a", "b", "1", "player", fight_db.FIGHT_RESULT.WIN)
+        before = list(self.db.get_fights())
+        fights = self.db.get_fights()
+        streamed = [next(fights)]
+        # replace the vote while the stream is open, the write must neither wait for it nor show up in it
+        writer = threading.Thread(target=self.db.insert_fight, args=("b", "a", "1", "player", fight_db.FIGHT_RESULT.WIN))
+        with contextlib.redirect_stdout(io.StringIO()):
+            writer.start()
+            writer.join(5)
+        self.assertFalse(writer.is_alive())
+        streamed += list(fights)
+        self.assertEqual(streamed, before)
+        after = self.fights_between("a", "b")
+        self.assertEqual([(fight[1], fight[2]) for fight in after], [("b", "a")])
+
+    def test_cached_reads_return_copies(self):
+        wins, draws, losses = self.db.get_matchups("a")
+        draws["a"].append("someone else")
+        self.db.get_ships().append("d")
+        self.assertEqual(self.db.get_matchups("a"), ({}, {"a": ["player"]}, {}))
+        self.assertNotIn("d", self.db.get_ships())
+
+    def test_cached_reads_see_writes(self):
+        self.assertEqual(self.db.get_matchups("a")[0], {})
+        self.db.insert_fight("a", "b", "1", "player", fight_db.FIGHT_RESULT.WIN)
+        self.assertEqual(self.db.get_matchups("a")[0], {"b": ["player"]})
+
+    def test_read_cache_is_per_database(self):
+        other_db = fight_db.FightDB(os.path.join(self.tmp_dir.name, "other.db"))
+        other_db.add_ship("z", "1", "player")
+        self.assertEqual(other_db.get_ships(), ["z"])
+        self.assertNotIn("z", self.db.get_ships())
+        other_db.close()
+
+    def test_missing_ship_error_names_the_first_missing_ship(self):
+        for check in (lambda: self.db.insert_fights([("a", "x"), ("y", "b")], "1", "player", fight_db.FIGHT_RESULT.WIN),
+                      lambda: self.db.simulate_fight("x", "y"),
+                      lambda: self.db.count_fight_results("a", "x")):
+            with self.assertRaisesRegex(ValueError, "Ship 'x' does not exist in the database"):
+                check()
+
+    def test_unknown_matchups_match_the_matchups(self):
+        self.db.add_ship("d", "2", "other")
+        self.db.insert_fights([("a", "b"), ("a", "d")], "1", "player", fight_db.FIGHT_RESULT.WIN)
+        self.db.insert_fight("c", "a", "2", "other", fight_db.FIGHT_RESULT.DRAW)
+        for shipname in ("a", "b", "c", "d"):
+            for player_name in (None, "player", "other", "nobody"):
+                wins, draws, losses = self.db.get_matchups(shipname, player_name)
+                matchups = wins.keys() | draws.keys() | losses.keys()
+                expected = [ship for ship in self.db.get_ships() if ship not in matchups]
+                self.assertEqual(sorted(self.db.get_unknown_matchups(shipname, player_name)), sorted(expected), (shipname, player_name))
+
+    def test_read_cache_evicts_the_least_recently_used_result(self):
+        self.db.get_matchups("a", "player 0")
+        for i in range(1, fight_db.READ_CACHE_SIZE):
+            self.db.get_matchups("a", f"player {i}")
+        # reading the first entry again makes the second one the oldest
+        self.db.get_matchups("a", "player 0")
+        self.db.get_matchups("a", f"player {fight_db.READ_CACHE_SIZE}")
+        self.assertEqual(len(self.db.read_cache), fight_db.READ_CACHE_SIZE)
+        keys = [key[1] for key in self.db.read_cache]
+        self.assertNotIn(("a", "player 1"), keys)
+        self.assertIn(("a", "player 0"), keys)
+        self.assertIn(("a", f"player {fight_db.READ_CACHE_SIZE}"), keys)
+
+
+if __name__ == "__main__":
+    unittest.main()